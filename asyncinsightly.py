@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# asyncio client library for v2.2 Insightly API
+# Requires Python 3.6 or newer, see insightly.py for the blocking client (Python 2.7 and 3.x)
+#
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import ssl
+import time
+import zlib
+
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlparse
+from io import BytesIO
+
+from insightly import OBJECT_ID_FIELDS, ConnectionPool, IdSet, encode_query, lowercase
+
+class AsyncConnectionPool(object):
+    """
+    Pool of persistent (keep-alive) HTTP/1.1 connections built on asyncio streams, the non-blocking
+    counterpart of insightly.ConnectionPool. Up to maxsize idle connections are kept per (scheme, host, port),
+    and connections idle for more than idle_timeout seconds are closed rather than reused.
+
+    As in insightly.ConnectionPool, a request on a reused connection that the server had already closed is sent
+    again on a new connection, but only if it failed before any part of the response arrived, and only for
+    idempotent methods, so a POST is never sent twice. Timeouts are never retried.
+    """
+    idempotent_methods = ConnectionPool.idempotent_methods
+
+    def __init__(self, maxsize=20, idle_timeout=60.0, timeout=60.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = dict()
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.ssl_context = ssl.create_default_context()
+
+    async def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+        now = time.time()
+        idle = self.idle.get(key, [])
+        while len(idle) > 0:
+            reader, writer, last_used = idle.pop()
+            if now - last_used < self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        self.connections_opened += 1
+        if scheme == 'https':
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=self.ssl_context), self.timeout)
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        return reader, writer, False
+
+    def release(self, scheme, host, port, reader, writer):
+        idle = self.idle.setdefault((scheme, host, port), [])
+        if len(idle) < self.maxsize:
+            idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        idle = self.idle
+        self.idle = dict()
+        for key in idle:
+            for reader, writer, last_used in idle[key]:
+                writer.close()
+
+    def is_stale(self, stage, error):
+        """
+        Returns True if an error while sending a request on a reused connection shows that the server had already
+        closed the connection, before any of the response arrived: the request could not be sent, or the connection
+        was closed or reset while waiting for the status line
+        """
+        if isinstance(error, asyncio.TimeoutError):
+            return False
+        if stage == 'request':
+            return isinstance(error, ConnectionError)
+        if stage == 'response':
+            if isinstance(error, asyncio.IncompleteReadError):
+                return len(error.partial) == 0
+            return isinstance(error, ConnectionError)
+        return False
+
+    async def read_response(self, reader, status_line):
+        """
+        Reads the rest of a response from the stream, after its status line, returns (status, reason, headers, body,
+        will_close)
+        """
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status = int(parts[1])
+        reason = ''
+        if len(parts) > 2:
+            reason = parts[2]
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        will_close = lowercase(headers.get('connection', '')) == 'close'
+        if lowercase(headers.get('transfer-encoding', '')) == 'chunked':
+            chunks = list()
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif status == 204 or status == 304:
+            body = b''
+        else:
+            body = await reader.read()
+            will_close = True
+        return status, reason, headers, body, will_close
+
+    async def urlopen(self, method, url, body=None, headers=None):
+        """
+        Sends a request and returns (status, headers, body), raises urllib.error.HTTPError if the server
+        returns an error (4xx or 5xx) status code.
+        """
+        parsed = urlparse(url)
+        scheme = parsed.scheme
+        host = parsed.hostname
+        port = parsed.port
+        if port is None:
+            if scheme == 'https':
+                port = 443
+            else:
+                port = 80
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        if body is None:
+            body = b''
+        lines = [method + ' ' + path + ' HTTP/1.1', 'Host: ' + parsed.netloc, 'Content-Length: ' + str(len(body))]
+        if headers is not None:
+            for h in headers:
+                lines.append(h + ': ' + headers[h])
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+        while True:
+            reader, writer, reused = await self.acquire(scheme, host, port)
+            stage = 'request'
+            try:
+                writer.write(message)
+                await writer.drain()
+                stage = 'response'
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not status_line:
+                    raise asyncio.IncompleteReadError(b'', None)
+                stage = 'body'
+                status, reason, response_headers, data, will_close = await asyncio.wait_for(
+                    self.read_response(reader, status_line), self.timeout)
+            except Exception as e:
+                writer.close()
+                if reused and method in self.idempotent_methods and self.is_stale(stage, e):
+                    # the server closed the idle connection, retry on a fresh one
+                    continue
+                raise
+            break
+        self.requests_sent += 1
+        if will_close:
+            writer.close()
+        else:
+            self.release(scheme, host, port, reader, writer)
+        if status >= 400:
+            raise HTTPError(url, status, reason, response_headers, BytesIO(data))
+        return status, response_headers, data
+
+class AsyncInsightly(object):
+    """
+    asyncio client for the Insightly API v2.2
+
+    This class mirrors the generic create, read, update and delete methods of insightly.Insightly, but each
+    method is a coroutine, and requests are sent over non-blocking keep-alive connections. At most
+    max_concurrency requests are in flight at once, so you can safely gather hundreds of calls on one event loop.
+
+    USAGE:
+
+    async def main():
+        async with AsyncInsightly(apikey='foozlebarzle') as i:
+            contacts = await asyncio.gather(*[i.get('contacts', c) for c in contact_ids])
+            async for project in i.iterate('projects'):
+                do_something_with(project)
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+    NOTE:
+
+    Unlike Insightly, the constructor does not fetch the user list (a constructor cannot wait on a request), and
+    the test mode is not supported. Call await i.read('users') if you need the user list.
+    """
+    def __init__(self, apikey='', version='2.2', dev=None, gzip=True, debug=False, max_concurrency=20,
+                 pool_size=None, idle_timeout=60):
+        if len(apikey) < 1:
+            try:
+                f = open('apikey.txt', 'r')
+                apikey = f.read().rstrip()
+                f.close()
+            except:
+                raise Exception('No API provided on instantiation, and apikey.txt file not found in project directory.')
+        version = str(version)
+        if version != '2.2' and version != 'mobile':
+            raise Exception('AsyncInsightly only supports the v2.2 and mobile APIs.')
+        self.apikey = apikey
+        self.version = version
+        self.debug = debug
+        self.gzip = gzip
+        if dev is not None:
+            self.baseurl = dev
+        elif version == 'mobile':
+            self.baseurl = 'https://mobileapi.insightly.com'
+        else:
+            self.baseurl = 'https://api.insight.ly/v' + version
+        if pool_size is None:
+            pool_size = max_concurrency
+        self.pool = AsyncConnectionPool(maxsize=pool_size, idle_timeout=idle_timeout)
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        self.pool.close()
+
+    async def create(self, object_type, object_graph, id=None, sub_type=None):
+        """
+        Creates (POST) an Insightly object, see Insightly.create()
+        """
+        if type(object_graph) is not dict:
+            raise Exception('object_graph must be a Python dictionary')
+        url = '/' + lowercase(object_type)
+        if id is not None:
+            url += '/' + str(id)
+            if sub_type is not None:
+                url += '/' + sub_type
+        return self.parse(await self.generateRequest(url, 'POST', json.dumps(object_graph)))
+
+    async def create_child(self, object_type, id, sub_type, object_graph):
+        """
+        Appends a child element, such as a link, to an existing object, see Insightly.create_child()
+        """
+        if type(object_graph) is not dict:
+            raise Exception('object graph must be a Python dictionary')
+        url = '/' + lowercase(object_type) + '/' + str(id) + '/' + sub_type
+        return self.parse(await self.generateRequest(url, 'POST', json.dumps(object_graph)))
+
+    async def delete(self, object_type, id, sub_type=None, sub_type_id=None):
+        """
+        Deletes an Insightly object or child object, see Insightly.delete()
+        """
+        url = '/' + lowercase(object_type)
+        if id is not None:
+            url += '/' + str(id)
+            if sub_type is not None:
+                url += '/' + sub_type
+                if sub_type_id is not None:
+                    url += '/' + str(sub_type_id)
+        await self.generateRequest(url, 'DELETE', '')
+        return True
+
+    async def generateRequest(self, url, method, data, headers=None):
+        """
+        Sends a request to the API and returns the (decompressed) response body. Waits for a free slot if
+        max_concurrency requests are already in flight.
+        """
+        if method not in ('GET', 'PUT', 'DELETE', 'POST'):
+            raise Exception('parameter method must be GET|DELETE|PUT|UPDATE')
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        request_headers = dict()
+        if self.gzip:
+            request_headers['Accept-Encoding'] = 'gzip'
+        if self.version == 'mobile':
+            credentials = self.apikey + ':FromInsightlyMobileApp'
+        else:
+            credentials = self.apikey
+        request_headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode('ascii')).decode('ascii')
+        request_headers['Content-Type'] = 'application/json'
+        if headers is not None:
+            request_headers.update(headers)
+        body = None
+        if method == 'PUT' or method == 'POST':
+            if type(data) is not bytes:
+                data = data.encode('utf-8')
+            body = data
+        async with self.semaphore:
+            status, response_headers, text = await self.pool.urlopen(method, self.baseurl + url, body, request_headers)
+        if self.debug:
+            print(method + ' ' + url + ' ' + str(status))
+        if self.gzip:
+            try:
+                text = zlib.decompress(text, zlib.MAX_WBITS|16)
+            except zlib.error:
+                # fall back to plain text if the server ignored the gzip encoding request
+                pass
+        return text
+
+    async def get(self, object_type, id, sub_type=None):
+        """
+        Returns a single Insightly object as a Python dictionary, see Insightly.get()
+        """
+        url = '/' + object_type + '/' + str(id)
+        if sub_type is not None:
+            url += '/' + sub_type
+        return self.parse(await self.generateRequest(url, 'GET', ''))
+
+    async def get_all(self, object_type, updated_after_utc='', ids_only=True):
+        """
+        Iterates through the entire recordset for an object type, optionally filtered by updated_after_utc,
+        returns an IdSet of object IDs if ids_only is True, see Insightly.get_all()
+        """
+        id_field = OBJECT_ID_FIELDS.get(object_type, None)
+        results = list()
+        async for r in self.iterate(object_type, updated_after_utc=updated_after_utc):
+            if ids_only:
+                if id_field is not None:
+                    results.append(r[id_field])
+            else:
+                results.append(r)
+        if ids_only:
+            return IdSet(results)
+        return results
+
+    async def iterate(self, object_type, updated_after_utc='', top=500):
+        """
+        Asynchronous iterator over every record of an object type, fetching one page of up to top records at a time
+        until an empty page is returned.
+
+        USAGE:
+
+        async for contact in i.iterate('contacts', updated_after_utc='2016-01-01'):
+            do_something_with(contact)
+        """
+        skip = 0
+        updated_after_utc = updated_after_utc.replace(' ', '+')
+        while True:
+            if updated_after_utc != '':
+                records = await self.search(object_type, 'updated_after_utc=' + updated_after_utc, top=top, skip=skip)
+            else:
+                records = await self.read(object_type, top=top, skip=skip)
+            if len(records) == 0:
+                break
+            for r in records:
+                yield r
+            # the server may cap the page size below top, so step by the size of the page, like Insightly.get_pages()
+            skip += len(records)
+
+    def parse(self, text):
+        return json.loads(text)
+
+    async def read(self, object_type, id=None, sub_type=None, top=None, skip=None, filters=None):
+        """
+        General purpose read method, returns a list of objects, see Insightly.read()
+        """
+        url = '/' + lowercase(object_type)
+        if id is not None:
+            url += '/' + str(id)
+            if sub_type is not None:
+                url += '/' + sub_type
+        elif filters is not None:
+            url += '/search'
+        if top is not None or skip is not None or filters is not None:
+            if top is not None:
+                url += '?top=' + str(top)
+            else:
+                url += '?top=100'
+            if skip is not None:
+                url += '&skip=' + str(skip)
+            if filters is not None:
+                if type(filters) is not dict or len(filters) > 1:
+                    raise Exception('Only one filter parameter is allowed per query at this time')
+                url += '&' + urlencode(filters)
+        results = self.parse(await self.generateRequest(url, 'GET', ''))
+        if type(results) is not list:
+            results = [results]
+        return results
+
+    async def search(self, object_type, expression, top=100, skip=0):
+        """
+        Server filtered search using a parm=value expression, see Insightly.search()
+        """
+        url = '/' + object_type + '/search?top=' + str(top)
+        if skip > 0:
+            url += '&skip=' + str(skip)
+        if expression.count('=') > 0:
+            parms = expression.split('=')
+            if len(parms) == 2:
+                url += '&' + parms[0].encode('ascii', 'xmlcharrefreplace').decode('ascii') + '=' + encode_query(parms[1])
+        results = self.parse(await self.generateRequest(url, 'GET', ''))
+        if type(results) is not list:
+            results = [results]
+        return results
+
+    async def update(self, object_type, object_graph, id=None, sub_type=None):
+        """
+        Updates (PUT) an existing Insightly object, see Insightly.update()
+        """
+        if type(object_graph) is not dict:
+            raise Exception('object_graph must be a Python dictionary')
+        url = '/' + lowercase(object_type)
+        if id is not None:
+            url += '/' + str(id)
+            if sub_type is not None:
+                url += '/' + sub_type
+        return self.parse(await self.generateRequest(url, 'PUT', json.dumps(object_graph)))
+
+    async def upload(self, object_type, id, filename):
+        """
+        Uploads a file attachment to an object, see Insightly.upload()
+        """
+        f = open(filename, 'rb')
+        value = f.read()
+        f.close()
+        boundary = '----------lImIt_of_THE_fIle_eW_$'
+        name = os.path.basename(filename)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        body = ('--' + boundary + '\r\n' +
+                'Content-Disposition: form-data; name="' + name + '"; filename="' + name + '"\r\n' +
+                'Content-Type: ' + content_type + '\r\n\r\n').encode('utf-8')
+        body += value + ('\r\n--' + boundary + '--\r\n').encode('utf-8')
+        headers = {'Content-Type': 'multipart/form-data; boundary=' + boundary}
+        url = '/' + object_type + '/' + str(id) + '/fileattachments'
+        return self.parse(await self.generateRequest(url, 'POST', body, headers=headers))
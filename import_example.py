@@ -3,9 +3,11 @@ from insightly import Insightly
 def main():
     i = Insightly()
     contact_ids = i.get_all('contacts')
-    for c in contact_ids:
-        contact = i.get('contacts', c)
+    errors = dict()
+    for contact in i.get_many('contacts', contact_ids, errors=errors):
         dummy(contact)
+    for contact_id in errors:
+        print('Could not fetch contact ' + str(contact_id) + ': ' + str(errors[contact_id]))
         
 def dummy(contact):
     # do something with the contact data, such as check external system
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# Insightly API Benchmark Script
+#
+# This Python module runs client library benchmarks against a local stand-in for the Insightly
+# API, so results are repeatable and do not touch a live account. The stand-in server speaks
+# HTTP/1.1 with keep-alive, serves synthetic contacts with top/skip (or id_after) pagination, and
+# honors count_total=true and gzip compression like the real API. Single records carry an ETag
+# (and are answered with 304 Not Modified when it matches), and PUT and DELETE are accepted.
+#
+# USAGE:
+#
+# from insightlybenchmark import benchmark_pool, benchmark_get_all, benchmark_json, benchmark_page_decode, benchmark_offline_query,
+#     benchmark_columnar
+# benchmark_pool(requests=2000)
+# benchmark_get_all(records=100000)
+# benchmark_json(records=500)
+# benchmark_page_decode(records=500)
+# benchmark_offline_query(sizes=[100000, 1000000])
+# benchmark_columnar(records=100000)
+#
+# or from the command line:
+#
+# python insightlybenchmark.py
+#
+
+import gzip
+import json
+import multiprocessing
+import threading
+import time
+import zlib
+from insightly import Insightly, JSONCodec, RecordTable, decode_json_array, default_codec, iter_json_array
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+try:
+    from io import BytesIO
+except ImportError:
+    from StringIO import StringIO as BytesIO
+
+def dummy_contact(contact_id):
+    """
+    Returns a synthetic contact record, with roughly the same fields and payload size as a real one
+    """
+    return {
+        'CONTACT_ID': contact_id,
+        'SALUTATION': None,
+        'FIRST_NAME': 'First' + str(contact_id),
+        'LAST_NAME': 'Last' + str(contact_id % 997),
+        'BACKGROUND': 'Met at the 2015 trade show, interested in the enterprise plan',
+        'IMAGE_URL': 'http://s3.amazonaws.com/insightly.userfiles/643478/',
+        'DEFAULT_LINKED_ORGANISATION': 1000 + contact_id % 50,
+        'OWNER_USER_ID': 1,
+        'DATE_CREATED_UTC': '2015-11-01 10:00:00',
+        'DATE_UPDATED_UTC': '2015-12-%02d 10:00:00' % (1 + contact_id % 28),
+        'VISIBLE_TO': 'EVERYONE',
+        'VISIBLE_TEAM_ID': None,
+        'VISIBLE_USER_IDS': None,
+        'CUSTOMFIELDS': [],
+        'ADDRESSES': [{'ADDRESS_ID': contact_id, 'ADDRESS_TYPE': 'WORK', 'STREET': str(contact_id) + ' Main Street',
+                       'CITY': 'Perth', 'STATE': 'WA', 'POSTCODE': '6000', 'COUNTRY': 'Australia'}],
+        'CONTACTINFOS': [{'CONTACT_INFO_ID': contact_id, 'TYPE': 'EMAIL', 'SUBTYPE': None, 'LABEL': 'WORK',
+                          'DETAIL': 'contact' + str(contact_id) + '@example.com'}],
+        'DATES': [],
+        'TAGS': [{'TAG_NAME': 'customer'}],
+        'LINKS': [],
+        'CONTACTLINKS': [],
+        'EMAILLINKS': [],
+    }
+
+def encode_body(data, gzipped):
+    body = json.dumps(data).encode('utf-8')
+    if gzipped:
+        buf = BytesIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb')
+        f.write(body)
+        f.close()
+        body = buf.getvalue()
+    return body
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the stand-in API server, see StandInHTTPServer
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, headers=None, body=None):
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if body is None:
+            body = encode_body(data, gzipped)
+        if headers is None:
+            headers = dict()
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for h in headers:
+            self.send_header(h, headers[h])
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_DELETE(self):
+        with self.server.lock:
+            self.server.requests_served.value += 1
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        with self.server.lock:
+            self.server.requests_served.value += 1
+        # the record is not kept, the server answers with the record as sent
+        length = int(self.headers.get('Content-Length', '0'))
+        self.send_json(json.loads(self.rfile.read(length).decode('utf-8')))
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests_served.value += 1
+            self.server.in_flight += 1
+            throttled = self.server.throttle_above is not None and self.server.in_flight > self.server.throttle_above
+        try:
+            if throttled:
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.server.latency > 0:
+                time.sleep(self.server.latency)
+            self.get_response()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def get_response(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p != '']
+        qs = parse_qs(url.query)
+        headers = dict()
+        if qs.get('count_total', [''])[0] == 'true':
+            headers['Total-Count'] = str(self.server.records)
+        if len(parts) > 0 and parts[0] == 'users':
+            self.send_json([{'USER_ID': 1, 'ACCOUNT_OWNER': True, 'FIRST_NAME': 'Foo', 'LAST_NAME': 'Bar',
+                             'EMAIL_ADDRESS': 'foo@bar.com', 'CONTACT_ID': 1, 'EMAIL_DROPBOX_IDENTIFIER': 'abc123'}], headers)
+        elif len(parts) > 1 and parts[1] != 'search':
+            if not parts[1].isdigit():
+                self.send_error(404)
+                return
+            headers['ETag'] = '"' + parts[0] + parts[1] + '"'
+            if self.headers.get('If-None-Match', None) == headers['ETag']:
+                self.send_response(304)
+                self.send_header('ETag', headers['ETag'])
+                self.end_headers()
+                return
+            self.send_json(dummy_contact(int(parts[1])), headers)
+        else:
+            top = int(qs.get('top', ['100'])[0])
+            if self.server.max_top is not None:
+                top = min(top, self.server.max_top)
+            skip = int(qs.get('skip', ['0'])[0])
+            if self.server.keyset and 'id_after' in qs:
+                # contact IDs are numbered from 1, so the records after an ID start at that position
+                skip = int(qs['id_after'][0])
+            start = min(skip, self.server.records)
+            end = min(skip + top, self.server.records)
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            self.send_json(None, headers, body=self.server.page(start, end, gzipped))
+
+class StandInHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    Multithreaded HTTP server behind StandInServer, which creates it in a child process (see serve_stand_in()).
+    Requests are counted in requests_served, a multiprocessing.Value shared with the parent process
+    """
+    daemon_threads = True
+
+    def __init__(self, records, port, latency, throttle_above, keyset, requests_served, max_top=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StandInHandler)
+        self.records = records
+        self.latency = latency
+        self.throttle_above = throttle_above
+        self.keyset = keyset
+        self.max_top = max_top
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.pages = dict()
+        self.requests_served = requests_served
+
+    def page(self, start, end, gzipped):
+        """
+        Returns the encoded body for the contacts in [start, end), pages are cached so that rendering them
+        does not dominate the timings
+        """
+        key = (start, end, gzipped)
+        if key not in self.pages:
+            self.pages[key] = encode_body([dummy_contact(n + 1) for n in range(start, end)], gzipped)
+        return self.pages[key]
+
+def serve_stand_in(records, port, latency, throttle_above, keyset, requests_served, connection, max_top=None):
+    """
+    Runs a StandInHTTPServer in a child process started by StandInServer.start(), after sending its port number
+    to the parent over connection (one end of a multiprocessing.Pipe)
+    """
+    server = StandInHTTPServer(records, port, latency, throttle_above, keyset, requests_served, max_top)
+    connection.send(server.server_address[1])
+    connection.close()
+    server.serve_forever()
+
+class StandInServer(object):
+    """
+    Local, multithreaded stand-in for the Insightly API serving the given number of synthetic contacts.
+    Call start() to serve from a child process (so the server does not compete with the client for the GIL),
+    and stop() to shut it down. The server is created in the child process, so this works with the spawn start
+    method as well as fork. The client base URL is available in self.url once the server has started, and the
+    number of requests served so far in self.requests_served
+
+    Set latency to add a fixed delay (in seconds) to every request, to simulate network round trip and
+    server processing time. Set throttle_above to answer 429 Too Many Requests (with Retry-After: 1) when more
+    than that many requests are in flight. Set keyset=False to ignore the id_after parameter, like a server that
+    does not support keyset pagination. Set max_top to return at most that many records per page, whatever the
+    top parameter asks for.
+    """
+    def __init__(self, records=1000, port=0, latency=0.0, throttle_above=None, keyset=True, max_top=None):
+        self.records = records
+        self.port = port
+        self.latency = latency
+        self.throttle_above = throttle_above
+        self.keyset = keyset
+        self.max_top = max_top
+        self.counter = multiprocessing.Value('l', 0)
+        self.process = None
+        self.url = None
+
+    @property
+    def requests_served(self):
+        return self.counter.value
+
+    def start(self):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_stand_in, args=(self.records, self.port, self.latency, self.throttle_above,
+                                                                           self.keyset, self.counter, child_connection, self.max_top))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        if not parent_connection.poll(30):
+            self.stop()
+            raise Exception('stand-in server did not start')
+        self.url = 'http://127.0.0.1:' + str(parent_connection.recv())
+        parent_connection.close()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+def requests_per_second(i, requests):
+    start_time = time.time()
+    for n in range(0, requests):
+        i.get('contacts', n + 1)
+    return requests / (time.time() - start_time)
+
+def benchmark_pool(requests=2000):
+    """
+    Measures requests per second for single record GETs, with and without the keep-alive connection pool
+    """
+    server = StandInServer().start()
+    results = dict()
+    for keep_alive in [False, True]:
+        i = Insightly(apikey='benchmark', dev=server.url, keep_alive=keep_alive)
+        rate = requests_per_second(i, requests)
+        results[keep_alive] = rate
+        print('keep_alive=' + str(keep_alive) + ': ' + str(int(rate)) + ' requests/second, ' +
+              str(i.pool.connections_opened) + ' connections opened')
+    print('speedup: ' + str(round(results[True] / results[False], 2)) + 'x')
+    server.stop()
+    return results
+
+def benchmark_get_all(records=100000, latency=0.05, max_workers=8):
+    """
+    Measures the wall time of get_all() over a large recordset, fetching pages one at a time and concurrently
+    """
+    server = StandInServer(records=records, latency=latency).start()
+    i = Insightly(apikey='benchmark', dev=server.url)
+    # warm up the stand-in server's page cache
+    i.get_all('contacts', ids_only=False, max_workers=max_workers)
+    results = dict()
+    for workers in [1, max_workers]:
+        start_time = time.time()
+        records = i.get_all('contacts', ids_only=False, max_workers=workers)
+        elapsed_time = time.time() - start_time
+        results[workers] = elapsed_time
+        print('max_workers=' + str(workers) + ': ' + str(len(records)) + ' records in ' + str(round(elapsed_time, 2)) + ' seconds')
+    print('speedup: ' + str(round(results[1] / results[max_workers], 2)) + 'x')
+    server.stop()
+    return results
+
+def benchmark_json(records=500, repetitions=200):
+    """
+    Measures the time to decode and encode a page of contacts with each JSON library that is installed, compared
+    with the standard library json module
+    """
+    page = [dummy_contact(n + 1) for n in range(0, records)]
+    body = json.dumps(page).encode('utf-8')
+    results = dict()
+    for library in ['json', 'simplejson', 'ujson', 'orjson']:
+        try:
+            codec = JSONCodec(library)
+        except Exception:
+            continue
+        start_time = time.time()
+        for n in range(0, repetitions):
+            codec.loads(body)
+        loads_time = (time.time() - start_time) / repetitions
+        start_time = time.time()
+        for n in range(0, repetitions):
+            codec.dumps(page)
+        dumps_time = (time.time() - start_time) / repetitions
+        results[library] = (loads_time, dumps_time)
+        print(library + ': loads ' + str(round(loads_time * 1000, 2)) + ' ms, dumps ' + str(round(dumps_time * 1000, 2)) +
+              ' ms per ' + str(records) + ' record page (' + str(len(body)) + ' bytes)')
+    for library in results:
+        if library != 'json':
+            print(library + ' speedup: loads ' + str(round(results['json'][0] / results[library][0], 2)) + 'x, dumps ' +
+                  str(round(results['json'][1] / results[library][1], 2)) + 'x')
+    return results
+
+def benchmark_page_decode(records=500, repetitions=200):
+    """
+    Measures the time to decompress and decode a gzipped page of contacts, as get_page() does: incrementally with
+    iter_json_array (as used by response='stream'), with zlib and the standard library json module, and with
+    decode_json_array and the fastest installed JSON library (as used by response='records')
+    """
+    body = encode_body([dummy_contact(n + 1) for n in range(0, records)], True)
+    decoders = [
+        ('iter_json_array', lambda: list(iter_json_array([body]))),
+        ('zlib + json', lambda: json.loads(zlib.decompress(body, zlib.MAX_WBITS|16).decode('utf-8'))),
+        ('decode_json_array (' + default_codec.library + ')', lambda: decode_json_array(body)),
+    ]
+    results = dict()
+    for name, decode in decoders:
+        start_time = time.time()
+        for n in range(0, repetitions):
+            decode()
+        results[name] = (time.time() - start_time) / repetitions
+        print(name + ': ' + str(round(results[name] * 1000, 2)) + ' ms per gzipped ' + str(records) + ' record page (' +
+              str(len(body)) + ' bytes)')
+    return results
+
+def benchmark_offline_query(sizes=[100000, 1000000], repetitions=3):
+    """
+    Measures the time of 'contains' queries in offline_query() with and without word indexes (see TextIndex), over
+    synthetic contacts without the child lists (addresses, contact infos, etc), so that a million of them fit in memory
+    """
+    queries = [
+        [('any', 'contains', 'contact4242@example')],
+        [('FIRST_NAME', 'contains', 'first99')],
+        [('any', 'contains', 'last5'), ('LAST_NAME', 'contains', 'st99')],
+        [('any', 'contains', 'zzz')],
+    ]
+    results = dict()
+    for size in sizes:
+        i = Insightly(apikey='benchmark', dev='http://127.0.0.1:1')
+        contacts = list()
+        for n in range(0, size):
+            contact = dummy_contact(n + 1)
+            contact['EMAIL_ADDRESS'] = 'contact' + str(n + 1) + '@example.com'
+            for field in list(contact):
+                if type(contact[field]) is list:
+                    del contact[field]
+            contacts.append(contact)
+        i.contacts = contacts
+        start_time = time.time()
+        for n in range(0, repetitions):
+            scanned = [i.offline_query('contacts', q) for q in queries]
+        scan_time = (time.time() - start_time) / repetitions / len(queries)
+        start_time = time.time()
+        i.add_index('contacts', 'any', text=True)
+        i.add_index('contacts', 'FIRST_NAME', text=True)
+        i.add_index('contacts', 'LAST_NAME', text=True)
+        build_time = time.time() - start_time
+        start_time = time.time()
+        for n in range(0, repetitions):
+            indexed = [i.offline_query('contacts', q) for q in queries]
+        index_time = (time.time() - start_time) / repetitions / len(queries)
+        if indexed != scanned:
+            raise Exception('indexed and scanned results differ')
+        results[size] = (scan_time, index_time, build_time)
+        print(str(size) + ' records: ' + str(round(scan_time * 1000, 2)) + ' ms per query scanned, ' +
+              str(round(index_time * 1000, 2)) + ' ms indexed (speedup ' + str(round(scan_time / index_time, 1)) +
+              'x), indexes built in ' + str(round(build_time, 2)) + ' seconds')
+    return results
+
+def benchmark_columnar(records=100000):
+    """
+    Measures the memory taken by synthetic contacts held as a list of dictionaries and as a RecordTable, compared with
+    the size of their JSON encoding, and the time of an offline_query() equality filter against each (requires
+    Python 3, for tracemalloc)
+    """
+    import tracemalloc
+    body = json.dumps([dummy_contact(n + 1) for n in range(0, records)])
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    contacts = json.loads(body)
+    list_memory = tracemalloc.get_traced_memory()[0] - start_memory
+    table = RecordTable(contacts)
+    contacts = None
+    table_memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+    print(str(records) + ' records: ' + str(len(body) // 1000000) + ' MB as JSON, ' + str(list_memory // 1000000) +
+          ' MB as dictionaries, ' + str(table_memory // 1000000) + ' MB as a RecordTable (' +
+          str(round(float(list_memory) / table_memory, 1)) + 'x smaller)')
+    i = Insightly(apikey='benchmark', dev='http://127.0.0.1:1')
+    query = [('LAST_NAME', '=', 'last5'), ('VISIBLE_TO', '=', 'everyone')]
+    results = dict(json = len(body), list = list_memory, table = table_memory)
+    for name, data in [('list', json.loads(body)), ('table', table)]:
+        i.contacts = data
+        start_time = time.time()
+        i.offline_query('contacts', query)
+        results[name + '_query'] = time.time() - start_time
+        print(name + ': ' + str(round(results[name + '_query'] * 1000, 1)) + ' ms per query')
+    return results
+
+if '__main__' == __name__:
+    benchmark_pool()
+    benchmark_get_all()
+    benchmark_json()
+    benchmark_page_decode()
+    benchmark_offline_query()
+    benchmark_columnar()
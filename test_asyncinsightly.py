@@ -0,0 +1,99 @@
+#
+# Unit tests for the asyncio client, against local stand-in servers. Requires Python 3.6 or newer, run with
+# python -m pytest, or python test_asyncinsightly.py
+#
+
+import asyncio
+import unittest
+
+from urllib.error import HTTPError
+
+from asyncinsightly import AsyncInsightly
+from insightly import IdSet
+from insightlybenchmark import StandInServer
+from test_insightly import ScriptedServer
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class AsyncConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        # the second request is read, and the connection closed without an answer
+        self.server = ScriptedServer([200, None])
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_post_not_resent(self):
+        async def main():
+            async with AsyncInsightly(apikey='test', dev=self.server.url, gzip=False) as i:
+                await i.get('contacts', 1)
+                with self.assertRaises(Exception):
+                    await i.create('contacts', {'FIRST_NAME': 'Ada'})
+        run(main())
+        self.assertEqual(self.server.requests, ['GET', 'POST'])
+
+    def test_get_resent(self):
+        async def main():
+            async with AsyncInsightly(apikey='test', dev=self.server.url, gzip=False) as i:
+                await i.get('contacts', 1)
+                return await i.get('contacts', 1)
+        self.assertEqual(run(main()), {'CONTACT_ID': 1})
+        self.assertEqual(self.server.requests, ['GET', 'GET', 'GET'])
+
+class AsyncInsightlyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+
+    def client(self, records=250, max_top=None, **kwargs):
+        self.server = StandInServer(records=records, max_top=max_top).start()
+        return AsyncInsightly(apikey='test', dev=self.server.url, **kwargs)
+
+    def test_gather(self):
+        i = self.client(max_concurrency=5)
+        async def main():
+            async with i:
+                return await asyncio.gather(*[i.get('contacts', n) for n in range(1, 51)])
+        self.assertEqual([record['CONTACT_ID'] for record in run(main())], list(range(1, 51)))
+        self.assertEqual(i.pool.requests_sent, 50)
+        # connections are kept alive, and there are never more than max_concurrency of them
+        self.assertTrue(i.pool.connections_opened <= 5, i.pool.connections_opened)
+
+    def test_get_all(self):
+        i = self.client(records=1234)
+        async def main():
+            async with i:
+                return await i.get_all('contacts'), await i.get_all('contacts', ids_only=False)
+        ids, records = run(main())
+        self.assertEqual(ids, IdSet(range(1, 1235)))
+        self.assertEqual([record['CONTACT_ID'] for record in records], list(range(1, 1235)))
+
+    def test_iterate_capped_pages(self):
+        # the server returns at most 40 records per page, whatever top asks for
+        i = self.client(max_top=40)
+        async def main():
+            async with i:
+                return [record['CONTACT_ID'] async for record in i.iterate('contacts', top=100)]
+        self.assertEqual(run(main()), list(range(1, 251)))
+
+    def test_write_and_errors(self):
+        i = self.client()
+        async def main():
+            async with i:
+                updated = await i.update('contacts', {'CONTACT_ID': 3, 'FIRST_NAME': 'Ada'})
+                deleted = await i.delete('contacts', 3)
+                with self.assertRaises(HTTPError) as context:
+                    await i.get('contacts', 'x')
+                return updated, deleted, context.exception.code
+        self.assertEqual(run(main()), ({'CONTACT_ID': 3, 'FIRST_NAME': 'Ada'}, True, 404))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,836 @@
+# -*- coding: UTF-8 -*-
+#
+# Unit tests for the library that run without the Insightly API: offline queries, indexes, record tables and
+# snapshots, and requests against the local stand-in server from insightlybenchmark.py. Run with python -m pytest,
+# or python test_insightly.py
+#
+# For tests against the live API, see insightlytest.py
+#
+
+import email.utils
+import errno
+import itertools
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+from insightly import (AdaptiveLimiter, ConnectionPool, FieldIndex, IdSet, Insightly, JSONCodec, PageSizer,
+                       ReadCache, RecordTable, RequestScheduler, ResponseCache, RetryPolicy, SQLiteStore, TextIndex,
+                       decode_json_array, iter_json_array, iter_merged, iter_prefetched, match_record, merge_records,
+                       run_in_order)
+from insightlybenchmark import StandInServer
+
+try:
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import HTTPError, URLError
+
+RECORDS = [
+    {'CONTACT_ID': 1, 'FIRST_NAME': 'Ada', 'LAST_NAME': 'Lovelace', 'SCORE': 10, 'RATE': 1.5, 'VIP': True,
+     'TAGS': [{'TAG_NAME': 'Perth'}], 'NOTE': 'x'},
+    {'CONTACT_ID': 2, 'FIRST_NAME': 'Grace', 'LAST_NAME': 'HOPPER', 'SCORE': 9, 'RATE': 2, 'VIP': False,
+     'TAGS': [], 'NOTE': 5},
+    {'CONTACT_ID': 3, 'FIRST_NAME': u'Émile', 'LAST_NAME': u'İnan', 'SCORE': 100, 'RATE': None,
+     'TAGS': None},
+    {'CONTACT_ID': 4, 'FIRST_NAME': 'alan', 'LAST_NAME': 'turing', 'SCORE': -3, 'RATE': 0.25, 'VIP': True,
+     'TAGS': [{'TAG_NAME': 'london'}], 'NOTE': None},
+    {'CONTACT_ID': 5, 'FIRST_NAME': None, 'LAST_NAME': '100%_done', 'SCORE': 9, 'RATE': 9.0},
+]
+
+FILTERS = [
+    [('SCORE', '>', 9)],
+    [('SCORE', '<', 10)],
+    [('SCORE', '=', 9)],
+    [('SCORE', '=', '9')],
+    [('SCORE', '>', '10')],
+    [('SCORE', 'contains', '0')],
+    [('RATE', '<', 2)],
+    [('RATE', '=', 9)],
+    [('VIP', '=', True)],
+    [('VIP', '=', 1)],
+    [('VIP', '=', 'true')],
+    [('LAST_NAME', '=', 'hopper')],
+    [('LAST_NAME', '>', 'M')],
+    [('LAST_NAME', '<', 'm')],
+    [('LAST_NAME', 'contains', '%_')],
+    [('LAST_NAME', 'contains', '_')],
+    [('LAST_NAME', '=', 100)],
+    [('FIRST_NAME', '=', u'émile')],
+    [('LAST_NAME', '=', u'i̇nan')],
+    [('FIRST_NAME', 'contains', 'A')],
+    [('FIRST_NAME', 'contains', '')],
+    [('NOTE', '=', 'x')],
+    [('NOTE', '=', 5)],
+    [('NOTE', 'contains', '5')],
+    [('TAGS', 'contains', 'perth')],
+    [('MISSING', '=', 'x')],
+    [('SCORE', 'like', 9)],
+    [('any', 'contains', 'perth')],
+    [('ANY', 'contains', "'vip': true")],
+    [('any', 'contains', 'lovelace'), ('SCORE', '>', 5)],
+    [('FIRST_NAME', 'contains', 'a'), ('RATE', '>', 0.5), ('VIP', '=', True)],
+]
+
+def offline_client():
+    return Insightly(apikey='test', dev='http://127.0.0.1:1')
+
+class ScriptedServer(object):
+    """
+    HTTP/1.1 server (with keep-alive) that answers requests in turn with the status codes in script, a 200 response
+    with the body {"CONTACT_ID": 1} once the script runs out. A None in the script reads the request and closes the
+    connection without answering it, like a server dropping an idle connection just as a request arrives. The methods
+    of the requests received are kept in self.requests
+    """
+    def __init__(self, script=None):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(16)
+        self.url = 'http://127.0.0.1:' + str(self.socket.getsockname()[1])
+        self.script = list(script or [])
+        self.requests = list()
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def read_request(self, f):
+        request_line = f.readline()
+        if not request_line:
+            return None
+        length = 0
+        while True:
+            line = f.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        f.read(length)
+        return request_line.split(b' ')[0].decode('ascii')
+
+    def handle(self, connection):
+        f = connection.makefile('rb')
+        try:
+            while True:
+                method = self.read_request(f)
+                if method is None:
+                    break
+                with self.lock:
+                    self.requests.append(method)
+                    status = 200
+                    if len(self.script) > 0:
+                        status = self.script.pop(0)
+                if status is None:
+                    break
+                body = b''
+                if status == 200:
+                    body = json.dumps({'CONTACT_ID': 1}).encode('utf-8')
+                connection.sendall(b'HTTP/1.1 ' + str(status).encode('ascii') + b' Scripted\r\n' +
+                                   b'Content-Type: application/json\r\nContent-Length: ' +
+                                   str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        except socket.error:
+            pass
+        f.close()
+        connection.close()
+
+    def close(self):
+        self.socket.close()
+
+class RecordTableTest(unittest.TestCase):
+    def test_round_trip(self):
+        table = RecordTable(RECORDS)
+        self.assertEqual(len(table), len(RECORDS))
+        self.assertEqual([record.asdict() for record in table], RECORDS)
+        self.assertEqual(table[-1].asdict(), RECORDS[-1])
+
+    def test_none_and_missing(self):
+        table = RecordTable(RECORDS)
+        self.assertTrue('TAGS' in table[2])
+        self.assertEqual(table[2]['TAGS'], None)
+        self.assertFalse('TAGS' in table[4])
+        self.assertEqual(table[4].get('TAGS', 'missing'), 'missing')
+        self.assertRaises(KeyError, lambda: table[4]['TAGS'])
+        self.assertEqual(sorted(table[4].keys()), sorted(RECORDS[4].keys()))
+
+    def test_bool_and_int(self):
+        table = RecordTable([{'A': 1}, {'A': True}, {'A': 0}, {'A': False}, {'A': 2 ** 70}])
+        values = [record['A'] for record in table]
+        self.assertEqual(values, [1, True, 0, False, 2 ** 70])
+        self.assertEqual([type(value) for value in values], [int, bool, int, bool, type(2 ** 70)])
+
+    def test_convert(self):
+        # an integer column that has to take text, then many distinct values, then lists
+        records = [{'A': n} for n in range(0, 10)] + [{'A': 'text'}] + [{'A': 'value' + str(n)} for n in range(0, 3000)]
+        records += [{'A': [1, 2]}, {'A': {'B': None}}, {'A': None}, {}]
+        table = RecordTable(records)
+        self.assertEqual([record.asdict() for record in table], records)
+
+    def test_select_matches_memory(self):
+        table = RecordTable(RECORDS)
+        for filters in FILTERS:
+            expected = [n for n in range(0, len(RECORDS)) if match_record(RECORDS[n], filters)]
+            self.assertEqual(table.select(filters), expected, filters)
+
+    def test_read_only(self):
+        table = RecordTable(RECORDS)
+        def assign():
+            table[0]['FIRST_NAME'] = 'Augusta'
+        self.assertRaises(TypeError, assign)
+
+class MergeTest(unittest.TestCase):
+    def test_merge(self):
+        records = [{'ID': 1, 'V': 'a'}, {'ID': 2, 'V': 'b'}, {'ID': 3, 'V': 'c'}]
+        updates = [{'ID': 4, 'V': 'd'}, {'ID': 2, 'V': 'B'}, {'ID': 2, 'V': 'BB'}]
+        expected = [{'ID': 1, 'V': 'a'}, {'ID': 2, 'V': 'BB'}, {'ID': 3, 'V': 'c'}, {'ID': 4, 'V': 'd'}]
+        self.assertEqual(merge_records(records, updates, 'ID'), expected)
+        self.assertEqual(list(iter_merged(iter(records), updates, 'ID')), expected)
+
+    def test_merge_nothing(self):
+        records = [{'ID': 1}, {'ID': 2}]
+        self.assertEqual(merge_records(records, [], 'ID'), records)
+        self.assertEqual(merge_records([], records, 'ID'), records)
+
+class JSONArrayTest(unittest.TestCase):
+    def test_chunks(self):
+        body = json.dumps(RECORDS).encode('utf-8')
+        expected = json.loads(body.decode('utf-8'))
+        # split the body at every position, including inside multi-byte characters
+        for n in range(0, len(body) + 1):
+            self.assertEqual(list(iter_json_array([body[:n], body[n:]])), expected)
+        self.assertEqual(list(iter_json_array([body[n:n + 1] for n in range(0, len(body))])), expected)
+
+    def test_gzip_and_object(self):
+        body = json.dumps(RECORDS).encode('utf-8')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        compressed = compressor.compress(body) + compressor.flush()
+        chunks = [compressed[n:n + 50] for n in range(0, len(compressed), 50)]
+        self.assertEqual(list(iter_json_array(chunks)), json.loads(body.decode('utf-8')))
+        self.assertEqual(list(iter_json_array([b'{"A": 1}'])), [{'A': 1}])
+        self.assertEqual(list(iter_json_array([b'[]'])), [])
+
+    def test_decode_json_array(self):
+        body = json.dumps(RECORDS).encode('utf-8')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        compressed = compressor.compress(body) + compressor.flush()
+        expected = json.loads(body.decode('utf-8'))
+        for codec in [None, JSONCodec('json')]:
+            self.assertEqual(decode_json_array(body, codec), expected)
+            self.assertEqual(decode_json_array(compressed, codec), expected)
+            self.assertEqual(decode_json_array(b'{"A": 1}', codec), [{'A': 1}])
+            self.assertEqual(decode_json_array(b'', codec), [])
+
+class IdSetTest(unittest.TestCase):
+    def test_set_operations(self):
+        ids = IdSet([5, 3, 3, 2 ** 40, 1])
+        self.assertEqual(list(ids), [1, 3, 5, 2 ** 40])
+        self.assertEqual(len(ids), 4)
+        self.assertTrue(3 in ids)
+        self.assertFalse(4 in ids)
+        self.assertEqual(ids[-1], 2 ** 40)
+        self.assertEqual(list(ids[1:3]), [3, 5])
+        self.assertEqual(ids - [3, 4], IdSet([1, 5, 2 ** 40]))
+        self.assertEqual(ids | IdSet([4]), IdSet([1, 3, 4, 5, 2 ** 40]))
+        self.assertEqual(ids & set([1, 2, 5]), IdSet([1, 5]))
+        self.assertNotEqual(ids, IdSet())
+
+    def test_dumps(self):
+        ids = IdSet(range(0, 1000, 7))
+        self.assertEqual(len(ids.dumps()), 8 * len(ids))
+        self.assertEqual(IdSet.loads(ids.dumps()), ids)
+        self.assertEqual(IdSet.loads(IdSet().dumps()), IdSet())
+
+class RunInOrderTest(unittest.TestCase):
+    def test_order_and_window(self):
+        started = list()
+        lock = threading.Lock()
+        def fetch(n):
+            with lock:
+                started.append(n)
+            # the first item is slow, the others keep trying to run ahead of it
+            time.sleep(0.2 if n == 0 else 0.001)
+            return n * 2
+        results = list()
+        for item, result, error in run_in_order(fetch, range(0, 50), max_workers=4, window=6):
+            with lock:
+                # items started, less the items yielded (including this one), are at most the window
+                self.assertTrue(len(started) - (len(results) + 1) <= 6, (len(started), len(results)))
+            results.append((item, result, error))
+        self.assertEqual(results, [(n, n * 2, None) for n in range(0, 50)])
+
+    def test_errors_and_early_stop(self):
+        def fetch(n):
+            if n == 3:
+                raise ValueError('page 3')
+            return n
+        results = list(run_in_order(fetch, range(0, 5), max_workers=2))
+        self.assertEqual([r[1] for r in results], [0, 1, 2, None, 4])
+        self.assertTrue(isinstance(results[3][2], ValueError))
+        started = list()
+        for item, result, error in run_in_order(lambda n: started.append(n), range(0, 1000), max_workers=2):
+            break
+        time.sleep(0.05)
+        self.assertTrue(len(started) <= 3)
+
+class PrefetchTest(unittest.TestCase):
+    def test_read_ahead(self):
+        produced = list()
+        def items():
+            for n in range(0, 100):
+                produced.append(n)
+                yield n
+        prefetched = iter_prefetched(items(), 2)
+        self.assertEqual(next(prefetched), 0)
+        time.sleep(0.2)
+        # the buffer holds two items, and the background thread waits with one more
+        self.assertEqual(len(produced), 4)
+        self.assertEqual(list(prefetched), list(range(1, 100)))
+
+    def test_error(self):
+        def items():
+            yield 1
+            raise ValueError('page failed')
+        results = list()
+        with self.assertRaises(ValueError):
+            for item in iter_prefetched(items()):
+                results.append(item)
+        self.assertEqual(results, [1])
+
+    def test_early_stop(self):
+        produced = list()
+        def items():
+            for n in range(0, 100):
+                produced.append(n)
+                yield n
+        for item in iter_prefetched(items(), 2):
+            break
+        time.sleep(0.3)
+        count = len(produced)
+        time.sleep(0.3)
+        self.assertEqual(len(produced), count)
+        self.assertTrue(count <= 4, count)
+
+class IndexTest(unittest.TestCase):
+    def check(self, i, data):
+        records = [dict(record) for record in RECORDS]
+        for filters in FILTERS:
+            expected = [record for record in records if match_record(record, filters)]
+            results = i.offline_query('contacts', filters)
+            if isinstance(data, RecordTable):
+                results = [record.asdict() for record in results]
+            self.assertEqual(results, expected, filters)
+
+    def test_indexes(self):
+        for data in [list(RECORDS), RecordTable(RECORDS)]:
+            i = offline_client()
+            i.contacts = data
+            for field in ['SCORE', 'VIP', 'LAST_NAME', 'FIRST_NAME', 'NOTE', 'TAGS', 'MISSING']:
+                i.add_index('contacts', field)
+                i.add_index('contacts', field, text=True)
+            i.add_index('contacts', 'any', text=True)
+            self.check(i, data)
+
+    def test_lookup(self):
+        index = FieldIndex(RECORDS, 'LAST_NAME')
+        self.assertEqual(index.lookup('HOPPER'), [1])
+        self.assertEqual(FieldIndex(RECORDS, 'SCORE').lookup(9), [1, 4])
+        text = TextIndex(RECORDS, 'any')
+        self.assertEqual(text.lookup('perth'), [0])
+        self.assertEqual(text.lookup('%'), None)
+
+    def test_rebuild(self):
+        i = offline_client()
+        i.contacts = [dict(record) for record in RECORDS]
+        i.add_index('contacts', 'LAST_NAME')
+        i.contacts[0]['LAST_NAME'] = 'Byron'
+        i.rebuild_indexes('contacts')
+        self.assertEqual(i.offline_query('contacts', ('LAST_NAME', '=', 'byron')), [i.contacts[0]])
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir('insightly_data')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        i = offline_client()
+        records = [dict(record, DATE_UPDATED_UTC='2016-01-0' + str(n + 1) + ' 00:00:00') for n, record in enumerate(RECORDS)]
+        header = i.save_snapshot('contacts', iter(records))
+        self.assertEqual(header['count'], len(records))
+        self.assertEqual(header['watermark'], '2016-01-05 00:00:00')
+        self.assertEqual(header['id_field'], 'CONTACT_ID')
+        self.assertEqual(sorted(header['fields']), sorted(set(itertools.chain.from_iterable(records))))
+        self.assertEqual(i.read_snapshot_header('contacts'), header)
+        self.assertEqual(list(i.iter_snapshot('contacts')), json.loads(json.dumps(records)))
+        self.assertEqual(os.listdir('insightly_data'), ['contacts.jsonl'])
+
+    def test_empty_and_replaced(self):
+        i = offline_client()
+        i.save_snapshot('contacts', RECORDS)
+        self.assertEqual(i.save_snapshot('contacts', [])['count'], 0)
+        self.assertEqual(list(i.iter_snapshot('contacts')), [])
+
+    def test_failed_save_keeps_snapshot(self):
+        i = offline_client()
+        i.save_snapshot('contacts', RECORDS)
+        def records():
+            yield RECORDS[0]
+            raise IOError('download failed')
+        self.assertRaises(IOError, i.save_snapshot, 'contacts', records())
+        self.assertEqual(list(i.iter_snapshot('contacts')), RECORDS)
+        self.assertEqual(os.listdir('insightly_data'), ['contacts.jsonl'])
+
+    def test_legacy_snapshot(self):
+        i = offline_client()
+        f = open('insightly_data/contacts.json', 'w')
+        json.dump(RECORDS, f)
+        f.close()
+        self.assertEqual(i.read_snapshot_header('contacts'), None)
+        self.assertEqual(list(i.iter_snapshot('contacts')), RECORDS)
+
+    def test_refresh_needs_version_2_2(self):
+        i = Insightly(apikey='test', dev='http://127.0.0.1:1', version='2.1')
+        self.assertRaises(Exception, i.refresh_snapshot, 'contacts')
+        self.assertEqual(os.listdir('insightly_data'), [])
+
+    def test_missing_snapshot(self):
+        i = offline_client()
+        self.assertEqual(i.read_snapshot_header('contacts'), None)
+        self.assertRaises(Exception, list, i.iter_snapshot('contacts'))
+
+class SchedulerTest(unittest.TestCase):
+    def test_limiter(self):
+        limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8)
+        for n in range(0, 40):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(limiter.limit, 8.0)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 4.0)
+        for n in range(0, 5):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 1.0)
+
+    def test_retry_delay(self):
+        scheduler = RequestScheduler('test-retry-delay', max_retry_after=60)
+        self.assertEqual(scheduler.retry_delay('5', 0), 5.0)
+        self.assertEqual(scheduler.retry_delay(None, 3), 8.0)
+        self.assertEqual(scheduler.retry_delay('3600', 0), 60)
+        self.assertEqual(scheduler.retry_delay('Thu, 01 Jan 1970 00:00:00 GMT', 0), 0.0)
+        later = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertTrue(25 <= scheduler.retry_delay(later, 0) <= 30)
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_counters(self):
+        cache = ResponseCache()
+        def count():
+            for n in range(0, 5000):
+                cache.hit()
+                cache.miss()
+        threads = [threading.Thread(target=count) for n in range(0, 8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.stats()['hits'], 40000)
+        self.assertEqual(cache.stats()['misses'], 40000)
+
+    def test_revalidate(self):
+        server = StandInServer(records=10).start()
+        try:
+            i = Insightly(apikey='test', dev=server.url)
+            contact = i.get('contacts', 3)
+            contact['FIRST_NAME'] = 'changed'
+            # the second request is a conditional GET, answered with 304 Not Modified
+            self.assertEqual(i.get('contacts', 3)['FIRST_NAME'], 'First3')
+            self.assertEqual(server.requests_served, 2)
+            self.assertEqual(i.response_cache.stats()['hits'], 1)
+            self.assertEqual(i.response_cache.stats()['misses'], 1)
+            # a write to the object type drops its cached responses
+            i.update('contacts', contact)
+            self.assertEqual(i.response_cache.stats()['entries'], 0)
+            self.assertEqual(i.get('contacts', 3)['FIRST_NAME'], 'First3')
+            self.assertEqual(i.response_cache.stats()['misses'], 2)
+        finally:
+            server.stop()
+
+class ReadCacheTest(unittest.TestCase):
+    def test_invalidate_on_write(self):
+        server = StandInServer(records=10).start()
+        try:
+            i = Insightly(apikey='test', dev=server.url, read_cache=ReadCache(ttl=60, ttls={'organisations': 0}))
+            i.get('contacts', 3)['FIRST_NAME'] = 'changed'
+            i.read('contacts', top=5)
+            self.assertEqual(i.get('contacts', 3)['FIRST_NAME'], 'First3')
+            self.assertEqual(len(i.read('contacts', top=5)), 5)
+            self.assertEqual(server.requests_served, 2)
+            # deleting a contact drops the cached copies of it, and the cached lists of contacts
+            i.get('contacts', 4)
+            i.delete('contacts', 3)
+            requests = server.requests_served
+            i.get('contacts', 3)
+            i.get('contacts', 4)
+            i.read('contacts', top=5)
+            self.assertEqual(server.requests_served, requests + 2)
+            # a TTL of 0 turns off caching for an object type
+            i.get('organisations', 1)
+            i.get('organisations', 1)
+            self.assertEqual(server.requests_served, requests + 4)
+        finally:
+            server.stop()
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_keep_alive(self):
+        server = StandInServer(records=10).start()
+        try:
+            for keep_alive, connections in [(True, 1), (False, 5)]:
+                i = Insightly(apikey='test', dev=server.url, keep_alive=keep_alive)
+                for n in range(1, 6):
+                    self.assertEqual(i.get('contacts', n)['CONTACT_ID'], n)
+                self.assertEqual(i.pool.requests_sent, 5)
+                self.assertEqual(i.pool.connections_opened, connections)
+        finally:
+            server.stop()
+
+    def test_stale_get_resent(self):
+        server = ScriptedServer([200, None])
+        try:
+            pool = ConnectionPool()
+            pool.urlopen('GET', server.url + '/contacts/1')
+            self.assertEqual(pool.urlopen('GET', server.url + '/contacts/1').status, 200)
+            self.assertEqual(server.requests, ['GET', 'GET', 'GET'])
+            self.assertEqual(pool.connections_opened, 2)
+        finally:
+            server.close()
+
+    def test_stale_post_not_resent(self):
+        server = ScriptedServer([200, None])
+        try:
+            pool = ConnectionPool()
+            pool.urlopen('GET', server.url + '/contacts/1')
+            with self.assertRaises(Exception):
+                pool.urlopen('POST', server.url + '/contacts', b'{}')
+            self.assertEqual(server.requests, ['GET', 'POST'])
+        finally:
+            server.close()
+
+    def test_new_connection_not_resent(self):
+        # only a reused connection can have been closed while idle, a fresh one failing is a real error
+        server = ScriptedServer([None])
+        try:
+            with self.assertRaises(Exception):
+                ConnectionPool().urlopen('GET', server.url + '/contacts/1')
+            self.assertEqual(server.requests, ['GET'])
+        finally:
+            server.close()
+
+class PageSizerTest(unittest.TestCase):
+    def test_record(self):
+        sizer = PageSizer(target_time=1.0, minimum=50, maximum=400, initial=100)
+        self.assertEqual(sizer.size('contacts'), 100)
+        # fast pages grow by at most a factor of two, slow pages shrink towards the target time
+        sizer.record('contacts', 100, 100, 0.1, 10000)
+        self.assertEqual(sizer.size('contacts'), 200)
+        sizer.record('contacts', 200, 200, 1.6, 20000)
+        self.assertEqual(sizer.size('contacts'), 125)
+        # a short last page does not grow the page size
+        sizer.record('contacts', 125, 10, 0.01, 1000)
+        self.assertEqual(sizer.size('contacts'), 125)
+        sizer.record('contacts', 125, 125, 100.0, 12500)
+        self.assertEqual(sizer.size('contacts'), 62)
+        sizer.record('contacts', 62, 62, 100.0, 6200)
+        self.assertEqual(sizer.size('contacts'), 50)
+        self.assertEqual(sizer.size('leads'), 100)
+        self.assertEqual(sizer.stats()['contacts']['pages'], 5)
+        self.assertEqual(sizer.stats()['contacts']['records'], 497)
+
+    def test_max_bytes(self):
+        sizer = PageSizer(target_time=1.0, minimum=10, maximum=400, initial=100, max_bytes=20000)
+        sizer.record('contacts', 100, 100, 0.1, 100000)
+        self.assertEqual(sizer.size('contacts'), 50)
+
+    def test_save(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'page_sizes.json')
+            sizer = PageSizer(filename=filename)
+            sizer.record('contacts', 500, 500, 10.0, 50000)
+            sizer.save()
+            # page sizes saved by another process for other object types are kept
+            other = PageSizer(filename=filename)
+            other.record('leads', 500, 500, 20.0, 50000)
+            other.save()
+            sizer = PageSizer(filename=filename)
+            self.assertEqual(sizer.size('contacts'), 250)
+            self.assertEqual(sizer.size('leads'), 250)
+            self.assertEqual(PageSizer(filename=filename, maximum=100).size('contacts'), 100)
+        finally:
+            shutil.rmtree(directory)
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_retryable(self):
+        retry = RetryPolicy()
+        unavailable = HTTPError('http://test', 503, 'Service Unavailable', {}, None)
+        self.assertTrue(retry.retryable('GET', unavailable))
+        self.assertFalse(retry.retryable('POST', unavailable))
+        self.assertTrue(RetryPolicy(retry_post=True).retryable('POST', unavailable))
+        self.assertFalse(retry.retryable('GET', HTTPError('http://test', 404, 'Not Found', {}, None)))
+        unavailable.throttled = True
+        self.assertFalse(retry.retryable('GET', unavailable))
+        self.assertTrue(retry.retryable('GET', socket.timeout()))
+        self.assertTrue(retry.retryable('GET', URLError(socket.timeout())))
+        self.assertTrue(retry.retryable('PUT', socket.error(errno.ECONNRESET, 'reset')))
+        self.assertFalse(retry.retryable('GET', socket.error(errno.ECONNREFUSED, 'refused')))
+        self.assertFalse(retry.retryable('GET', socket.gaierror(socket.EAI_NONAME, 'unknown host')))
+
+    def client(self, server, **kwargs):
+        return Insightly(apikey='test', dev=server.url, retry=RetryPolicy(base_delay=0.01, **kwargs))
+
+    def test_retry_5xx(self):
+        server = ScriptedServer([503, 502])
+        try:
+            i = self.client(server)
+            self.assertEqual(i.get('contacts', 1), {'CONTACT_ID': 1})
+            self.assertEqual(server.requests, ['GET', 'GET', 'GET'])
+            self.assertEqual(i.retry.retries, 2)
+        finally:
+            server.close()
+
+    def test_retry_dropped_connection(self):
+        server = ScriptedServer([None])
+        try:
+            i = self.client(server)
+            self.assertEqual(i.get('contacts', 1), {'CONTACT_ID': 1})
+            self.assertEqual(server.requests, ['GET', 'GET'])
+        finally:
+            server.close()
+
+    def test_give_up(self):
+        server = ScriptedServer([503] * 5)
+        try:
+            i = self.client(server, max_attempts=3)
+            with self.assertRaises(HTTPError):
+                i.get('contacts', 1)
+            self.assertEqual(server.requests, ['GET', 'GET', 'GET'])
+        finally:
+            server.close()
+
+    def test_post_not_retried(self):
+        server = ScriptedServer([503])
+        try:
+            i = self.client(server)
+            with self.assertRaises(HTTPError):
+                i.generateRequest('/contacts', 'POST', '{}')
+            self.assertEqual(server.requests, ['POST'])
+        finally:
+            server.close()
+
+class StandInTest(unittest.TestCase):
+    """
+    Tests against a StandInServer, serving synthetic contacts
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        # page sizes and the user cache are saved in the working directory
+        os.chdir(self.directory)
+        self.server = None
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+        if self.server is not None:
+            self.server.stop()
+
+    def client(self, records=250, latency=0.0, throttle_above=None, keyset=True, **kwargs):
+        self.server = StandInServer(records=records, latency=latency, throttle_above=throttle_above,
+                                    keyset=keyset).start()
+        return Insightly(apikey='test', dev=self.server.url, **kwargs)
+
+    def peak_concurrency(self, i):
+        """
+        Wraps the client's connection pool to record the largest number of requests in flight at once
+        """
+        lock = threading.Lock()
+        counts = dict(in_flight = 0, peak = 0)
+        urlopen = i.pool.urlopen
+        def counted(*args, **kwargs):
+            with lock:
+                counts['in_flight'] += 1
+                counts['peak'] = max(counts['peak'], counts['in_flight'])
+            try:
+                return urlopen(*args, **kwargs)
+            finally:
+                with lock:
+                    counts['in_flight'] -= 1
+        i.pool.urlopen = counted
+        return counts
+
+    def test_limit_grows(self):
+        i = self.client(records=2000, latency=0.05, max_concurrency=16)
+        counts = self.peak_concurrency(i)
+        pages = list(i.get_pages('contacts', top=25))
+        self.assertEqual(sum([len(page) for page in pages]), 2000)
+        # the limiter starts at 4, and grows as requests succeed
+        self.assertTrue(i.scheduler.limiter.limit > 4, i.scheduler.limiter.limit)
+        self.assertTrue(counts['peak'] > 4, counts['peak'])
+        self.assertTrue(counts['peak'] <= 16, counts['peak'])
+        # an explicit max_workers still caps the threads
+        i.scheduler.limiter.limit = 16.0
+        counts = self.peak_concurrency(i)
+        list(i.get_pages('contacts', top=25, max_workers=2))
+        self.assertTrue(counts['peak'] <= 2, counts['peak'])
+
+    def test_throttling(self):
+        # more than 3 requests in flight are answered with 429 Too Many Requests and Retry-After: 1
+        i = self.client(records=1000, latency=0.05, throttle_above=3, max_concurrency=8)
+        start_time = time.time()
+        records = i.get_all('contacts', ids_only=False)
+        self.assertEqual([r['CONTACT_ID'] for r in records], list(range(1, 1001)))
+        if i.scheduler.throttled > 0:
+            self.assertTrue(time.time() - start_time >= 1.0)
+        counts = self.peak_concurrency(i)
+        i.scheduler.limiter.limit = 8.0
+        throttled = i.scheduler.throttled
+        records = list(itertools.chain.from_iterable(i.get_pages('contacts', top=20)))
+        self.assertEqual(len(records), 1000)
+        self.assertTrue(i.scheduler.throttled > throttled)
+        # each throttled request halves the limit
+        self.assertTrue(i.scheduler.limiter.limit < 8.0, i.scheduler.limiter.limit)
+
+    def test_get_all(self):
+        i = self.client(records=1234, latency=0.01)
+        ids = i.get_all('contacts', max_workers=4)
+        self.assertTrue(isinstance(ids, IdSet))
+        self.assertEqual(list(ids), list(range(1, 1235)))
+        records = i.get_all('contacts', ids_only=False, max_workers=1)
+        self.assertEqual([r['CONTACT_ID'] for r in records], list(range(1, 1235)))
+
+    def test_keyset(self):
+        i = self.client(records=1000)
+        pages = list(i.get_pages('contacts', top=90, keyset=True))
+        self.assertEqual([r['CONTACT_ID'] for r in itertools.chain.from_iterable(pages)], list(range(1, 1001)))
+        self.assertEqual(pages[0].last_id, 90)
+        self.assertEqual(pages[1].skip, 90)
+        # resume after the last ID of a page
+        pages = list(i.get_pages('contacts', top=90, keyset=True, id_after=pages[5].last_id))
+        self.assertEqual([r['CONTACT_ID'] for r in itertools.chain.from_iterable(pages)], list(range(541, 1001)))
+        self.assertFalse('contacts' in i.keyset_unsupported)
+
+    def test_keyset_fallback(self):
+        # the server ignores id_after, so the scan carries on with skip offsets
+        i = self.client(records=1000, keyset=False)
+        self.assertEqual(list(i.get_all('contacts', keyset=True)), list(range(1, 1001)))
+        self.assertTrue('contacts' in i.keyset_unsupported)
+        records = [r for page in i.get_pages('contacts', top=90, keyset=True) for r in page]
+        self.assertEqual([r['CONTACT_ID'] for r in records], list(range(1, 1001)))
+
+    def test_get_many(self):
+        i = self.client()
+        errors = dict()
+        records = i.get_many('contacts', [3, 1, 3, 'x', 2], max_workers=4, errors=errors)
+        self.assertEqual([r['CONTACT_ID'] for r in records], [3, 1, 2])
+        self.assertEqual(list(errors.keys()), ['x'])
+        self.assertEqual(errors['x'].code, 404)
+        self.assertEqual(self.server.requests_served, 4)
+        records = i.get_many('contacts', [5, 4], as_dict=True)
+        self.assertEqual(sorted(records.keys()), [4, 5])
+        self.assertEqual(records[5]['FIRST_NAME'], 'First5')
+
+    def test_page_sizer(self):
+        i = self.client(records=3000, page_sizer=PageSizer(target_time=1.0, initial=50, maximum=400))
+        sizes = [len(page) for page in i.get_pages('contacts', max_workers=1)]
+        # quick pages double the page size each time, up to the maximum
+        self.assertEqual(sizes[:5], [50, 100, 200, 400, 400])
+        self.assertEqual(sum(sizes), 3000)
+        self.assertEqual(i.page_sizer.stats()['contacts']['records'], 3000)
+
+    def test_prefetch(self):
+        i = self.client(records=1000, latency=0.01)
+        pages = list(i.get_pages('contacts', top=100, max_workers=1, prefetch=2))
+        self.assertEqual([page.skip for page in pages], list(range(0, 1000, 100)))
+        self.assertEqual([r['CONTACT_ID'] for r in itertools.chain.from_iterable(pages)], list(range(1, 1001)))
+
+    def test_count(self):
+        i = self.client(records=300)
+        self.assertEqual(i.count('contacts'), 300)
+        self.assertEqual(i.count_many(['contacts', 'organisations']), {'contacts': 300, 'organisations': 300})
+
+    def test_expand(self):
+        i = self.client()
+        expanded = dict(i.expand('contacts', [1, 2, 2, 3]))
+        self.assertEqual(sorted(expanded), [1, 2, 3])
+        self.assertEqual(expanded[2]['CONTACT_ID'], 2)
+        requests = self.server.requests_served
+        expanded[2]['FIRST_NAME'] = 'changed'
+        again = dict(i.expand('contacts', [{'CONTACT_ID': 2}]))
+        self.assertEqual(again[2]['FIRST_NAME'], 'First2')
+        self.assertEqual(self.server.requests_served, requests)
+
+class SQLiteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SQLiteStore(os.path.join(self.directory, 'insightly.db'))
+        self.store.replace('contacts', RECORDS)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_column_types(self):
+        columns = self.store.get_columns('contacts')
+        self.assertEqual(columns['CONTACT_ID'], 'INTEGER')
+        self.assertEqual(columns['SCORE'], 'INTEGER')
+        self.assertEqual(columns['RATE'], 'REAL')
+        self.assertEqual(columns['LAST_NAME'], 'TEXT')
+        self.assertFalse('NOTE' in columns)
+        self.assertFalse('TAGS' in columns)
+
+    def test_query_matches_memory(self):
+        for filters in FILTERS:
+            expected = [record for record in RECORDS if match_record(record, filters)]
+            self.assertEqual(self.store.query('contacts', filters), expected, filters)
+
+    def test_query_after_reopen(self):
+        self.store.close()
+        self.store = SQLiteStore(os.path.join(self.directory, 'insightly.db'))
+        for filters in FILTERS:
+            expected = [record for record in RECORDS if match_record(record, filters)]
+            self.assertEqual(self.store.query('contacts', filters), expected, filters)
+
+    def test_replace_from_generator(self):
+        self.store.replace('contacts', (dict(record) for record in reversed(RECORDS)))
+        self.assertEqual(list(self.store.records('contacts')), list(reversed(RECORDS)))
+        self.assertEqual(self.store.get_columns('contacts')['SCORE'], 'INTEGER')
+        self.assertEqual(self.store.query('contacts', [('SCORE', '>', 9)]), [RECORDS[2], RECORDS[0]])
+
+    def test_failed_replace_keeps_records(self):
+        # the second record cannot be saved as JSON
+        rows = [{'CONTACT_ID': 6, 'SCORE': 1}, {'CONTACT_ID': 7, 'SCORE': object()}]
+        self.assertRaises(Exception, self.store.replace, 'contacts', rows)
+        self.assertEqual(self.store.count('contacts'), len(RECORDS))
+        self.assertEqual(list(self.store.records('contacts')), RECORDS)
+
+if __name__ == '__main__':
+    unittest.main()